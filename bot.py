@@ -8,14 +8,16 @@ Core features (MVP):
 """
 
 import os
+import re
 import asyncio
+import sqlite3
 from typing import Optional
 
 import discord
 from discord import Embed
 from dotenv import load_dotenv
 
-from db import Database
+from db import Database, normalize_keywords
 
 # ---------------------------------------------------------------------------
 # Config / setup
@@ -35,19 +37,34 @@ intents = discord.Intents.default()
 # Channel where search is allowed
 SEARCH_CHANNEL_NAME = "search-user"
 
+class MatchBotClient(discord.Client):
+    async def close(self) -> None:
+        # Commit queued profile writes before the event loop goes away
+        await _flush_upserts()
+        await super().close()
+
+
 # Global client + database
-client = discord.Client(intents=intents)
+client = MatchBotClient(intents=intents)
 db = Database("profiles.db")
 
+# Profile writes are queued here as (profile, future) pairs and committed in
+# batches by _drain_upserts, which resolves each future once its batch is done
+upsert_q: asyncio.Queue = asyncio.Queue()
+_drain_task: Optional[asyncio.Task] = None
+
+# Open DM conversations by user ID; on_message feeds replies into them
+_dm_sessions: dict[int, "DMSession"] = {}
+
+# "<@id> rest" / "<@!id> rest" matcher, compiled in on_ready once our user ID is known
+_MENTION_RE: Optional[re.Pattern] = None
+
 
 # ---------------------------------------------------------------------------
 # Helper functions
 # ---------------------------------------------------------------------------
 
-def is_mention_command(
-    message: discord.Message,
-    bot_user_id: int,
-) -> Optional[str]:
+def is_mention_command(message: discord.Message) -> Optional[str]:
     """
     If the message starts with a mention of the bot, return the rest of the text
     (command + args). Otherwise return None.
@@ -56,46 +73,146 @@ def is_mention_command(
         "<@1234> create-profile"
         "<@!1234> search ai"
     """
-    content = message.content.strip()
-    lead1 = f"<@{bot_user_id}>"
-    lead2 = f"<@!{bot_user_id}>"
-
-    if content.startswith(lead1):
-        return content[len(lead1):].strip()
-    if content.startswith(lead2):
-        return content[len(lead2):].strip()
-    return None
-
-
-async def prompt_user(
-    user: discord.User | discord.Member,
-    question: str,
-    timeout: int = 120,
-) -> Optional[str]:
+    if _MENTION_RE is None:
+        return None
+    m = _MENTION_RE.match(message.content)
+    return m.group(1) if m else None
+
+
+class DMSession:
     """
-    Ask the user a question in DM and wait for a reply.
+    A question/answer conversation with one user over DM.
+
+    While the session is open, on_message routes that user's DM replies into
+    the session's queue, so asking several questions does not install and
+    tear down a wait_for listener for each one.
 
-    Returns:
-        - stripped message content if the user replied in time
-        - None if it timed out
+    A user has at most one open session; a second create/update while one
+    is running is refused rather than taking over the first one's replies.
+
+    Usage:
+        async with DMSession(user) as session:
+            if session is None:
+                ...  # already in a conversation
+            name = await session.ask("Your name?")
     """
-    try:
-        dm = user.dm_channel
-        if dm is None:
-            dm = await user.create_dm()
 
-        await dm.send(question)
+    def __init__(
+        self,
+        user: discord.User | discord.Member,
+        timeout: int = 120,
+    ) -> None:
+        self.user = user
+        self.timeout = timeout
+        self._dm: Optional[discord.DMChannel] = None
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+
+    async def __aenter__(self) -> Optional["DMSession"]:
+        """
+        Register the session for the user.
+
+        Returns None if the user already has an open session. The check and
+        registration happen before the first await, so two commands cannot
+        both claim the user.
+        """
+        if self.user.id in _dm_sessions:
+            return None
+        _dm_sessions[self.user.id] = self
+        try:
+            self._dm = self.user.dm_channel or await self.user.create_dm()
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._release()
+
+    def _release(self) -> None:
+        if _dm_sessions.get(self.user.id) is self:
+            del _dm_sessions[self.user.id]
+
+    def feed(self, message: discord.Message) -> None:
+        """Called from on_message with each DM reply from the user."""
+        self._queue.put_nowait(message.content.strip())
+
+    async def ask(self, question: str) -> Optional[str]:
+        """
+        Send a question and wait for the next reply.
+
+        Returns:
+            - stripped message content if the user replied in time
+            - None if it timed out
+        """
+        await self._dm.send(question)
+        try:
+            return await asyncio.wait_for(self._queue.get(), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+# sqlite calls run in worker threads so a slow query never blocks the event loop
+async def db_search(keyword: str) -> list[sqlite3.Row]:
+    return await asyncio.to_thread(db.search, keyword)
+
+
+async def db_get_profile(user_id: str) -> Optional[sqlite3.Row]:
+    return await asyncio.to_thread(db.get_profile, user_id)
+
+
+async def db_list_profiles() -> list[dict]:
+    return await asyncio.to_thread(db.list_all_profiles)
+
+
+async def save_profile(profile: dict) -> None:
+    """
+    Queue a profile write and wait until its batch has been committed.
+    Raises whatever upsert_many raised if the batch failed.
+    """
+    done = asyncio.get_running_loop().create_future()
+    await upsert_q.put((profile, done))
+    await done
 
-        def check(m: discord.Message) -> bool:
-            return (
-                m.author.id == user.id
-                and isinstance(m.channel, discord.DMChannel)
-            )
 
-        msg = await client.wait_for("message", check=check, timeout=timeout)
-        return msg.content.strip()
-    except asyncio.TimeoutError:
-        return None
+async def _drain_upserts() -> None:
+    """
+    Background task: collect queued profile writes for a short window and
+    commit them with a single executemany transaction.
+    """
+    while True:
+        batch = [await upsert_q.get()]
+        await asyncio.sleep(0.05)
+        while not upsert_q.empty():
+            batch.append(upsert_q.get_nowait())
+
+        try:
+            await asyncio.to_thread(db.upsert_many, [profile for profile, _ in batch])
+        except Exception as e:
+            print(f"Failed to save {len(batch)} profile(s): {e}")
+            for _, done in batch:
+                if not done.done():
+                    done.set_exception(e)
+        else:
+            for _, done in batch:
+                if not done.done():
+                    done.set_result(None)
+        finally:
+            for _ in batch:
+                upsert_q.task_done()
+
+
+async def _flush_upserts() -> None:
+    """Wait for every queued profile write to be committed, then stop the writer."""
+    global _drain_task
+
+    if _drain_task is None:
+        if upsert_q.empty():
+            return
+        _drain_task = asyncio.create_task(_drain_upserts())
+
+    await upsert_q.join()
+    _drain_task.cancel()
+    _drain_task = None
 
 
 # ---------------------------------------------------------------------------
@@ -104,9 +221,17 @@ async def prompt_user(
 
 @client.event
 async def on_ready() -> None:
+    global _drain_task, _MENTION_RE
+
     print(f"Logged in as {client.user} (ID: {client.user.id})")
     print("------")
 
+    _MENTION_RE = re.compile(rf"^\s*<@!?{client.user.id}>\s*(.*?)\s*$", re.DOTALL)
+
+    # on_ready fires again after reconnects; only start one writer
+    if _drain_task is None:
+        _drain_task = asyncio.create_task(_drain_upserts())
+
 
 @client.event
 async def on_message(message: discord.Message) -> None:
@@ -114,8 +239,15 @@ async def on_message(message: discord.Message) -> None:
     if message.author.bot:
         return
 
+    # Replies to an open create/update conversation
+    if isinstance(message.channel, discord.DMChannel):
+        session = _dm_sessions.get(message.author.id)
+        if session is not None:
+            session.feed(message)
+            return
+
     # Only respond to messages that start with a mention of the bot
-    cmd_text = is_mention_command(message, client.user.id)
+    cmd_text = is_mention_command(message)
     if cmd_text is None:
         return
 
@@ -130,165 +262,181 @@ async def on_message(message: discord.Message) -> None:
     # CREATE PROFILE
     # -------------------------------------------------------------------
     if cmd == "create-profile":
-        await message.channel.send(
-            f"{message.author.mention} I sent you a DM to create your profile."
-        )
-
         user = message.author
 
-        name = await prompt_user(
-            user,
-            'Please provide your Full Name (e.g., "Elon Musk"):',
-        )
-        if name is None:
-            await user.send("Timed out. Profile creation cancelled.")
-            return
-
-        role = await prompt_user(
-            user,
-            'Please provide your current Role (e.g., "AI founder"):',
-        )
-        if role is None:
-            await user.send("Timed out. Profile creation cancelled.")
-            return
+        async with DMSession(user) as session:
+            if session is None:
+                await message.channel.send(
+                    f"{user.mention} You already have a profile conversation open in your DMs. "
+                    "Finish it (or let it time out) first."
+                )
+                return
 
-        description = await prompt_user(
-            user, "Short 30 words description of yourself:"
-        )
-        if description is None:
-            await user.send("Timed out. Profile creation cancelled.")
-            return
+            await message.channel.send(
+                f"{user.mention} I sent you a DM to create your profile."
+            )
 
-        keywords = await prompt_user(
-            user,
-            "Keywords — comma separated (e.g., investor, AI founder, cybersecurity):",
-        )
-        if keywords is None:
-            await user.send("Timed out. Profile creation cancelled.")
-            return
+            # One round-trip for the three single-line fields; anything the
+            # reply leaves out is asked for on its own below.
+            prompts = [
+                'Full Name (e.g., "Elon Musk")',
+                'Current Role (e.g., "AI founder")',
+                'Company/Organization (e.g., "Tesla", "Stanford University")',
+            ]
+            basics = await session.ask(
+                "Please reply with three lines (use Shift+Enter for a new line):\n"
+                + "\n".join(prompts),
+            )
+            if basics is None:
+                await user.send("Timed out. Profile creation cancelled.")
+                return
+
+            fields = [line.strip() for line in basics.splitlines() if line.strip()][:3]
+            for prompt in prompts[len(fields):]:
+                answer = await session.ask(f"{prompt}:")
+                if answer is None:
+                    await user.send("Timed out. Profile creation cancelled.")
+                    return
+                fields.append(answer)
+            name, role, company_name = fields
+
+            description = await session.ask(
+                "Short 30 words description of yourself:"
+            )
+            if description is None:
+                await user.send("Timed out. Profile creation cancelled.")
+                return
 
-        company_name = await prompt_user(
-            user,
-            'Please provide your Company/Organization (e.g., "Tesla", "Stanford University"):',
-        )
-        if company_name is None:
-            await user.send("Timed out. Profile creation cancelled.")
-            return
+            keywords = await session.ask(
+                "Keywords — comma separated (e.g., investor, AI founder, cybersecurity):",
+            )
+            if keywords is None:
+                await user.send("Timed out. Profile creation cancelled.")
+                return
 
-        linkedin_url = await prompt_user(
-            user,
-            'Please provide your LinkedIn URL (e.g., "https://linkedin.com/in/yourname") or leave empty to skip:',
-        )
-        if linkedin_url is None:
-            await user.send("Timed out. Profile creation cancelled.")
-            return
+            linkedin_url = await session.ask(
+                'Please provide your LinkedIn URL (e.g., "https://linkedin.com/in/yourname") or leave empty to skip:',
+            )
+            if linkedin_url is None:
+                await user.send("Timed out. Profile creation cancelled.")
+                return
         
-        # Allow empty LinkedIn URL
-        if linkedin_url.strip() == "":
-            linkedin_url = None
+            # Allow empty LinkedIn URL
+            if linkedin_url.strip() == "":
+                linkedin_url = None
+
+            keywords_norm = normalize_keywords(keywords)
+
+            # For now, we store name_role as both name and role for simplicity.
+            try:
+                await save_profile(dict(
+                    user_id=str(user.id),
+                    name=name,
+                    role=role,
+                    description=description,
+                    keywords=keywords_norm,
+                    company_name=company_name,
+                    linkedin_url=linkedin_url,
+                ))
+            except Exception:
+                await user.send("Could not save your profile. Please try again later.")
+                return
 
-        keywords_norm = ",".join(
-            [k.strip().lower() for k in keywords.split(",") if k.strip()]
-        )
-
-        # For now, we store name_role as both name and role for simplicity.
-        db.upsert_profile(
-            user_id=str(user.id),
-            name=name,
-            role=role,
-            description=description,
-            keywords=keywords_norm,
-            company_name=company_name,
-            linkedin_url=linkedin_url,
-        )
-
-        await user.send(
-            "✅ Profile saved. You can update it with `@MatchBot update-profile`."
-        )
+            await user.send(
+                "✅ Profile saved. You can update it with `@MatchBot update-profile`."
+            )
 
     # -------------------------------------------------------------------
     # UPDATE PROFILE
     # -------------------------------------------------------------------
     elif cmd == "update-profile":
-        await message.channel.send(
-            f"{message.author.mention} I sent you a DM to update your profile."
-        )
-
         user = message.author
-        profile = db.get_profile(str(user.id))
-        if not profile:
-            await user.send(
-                "No existing profile found. Use `@MatchBot create-profile` to create one."
-            )
-            return
 
-        name_role = profile["name"]
-        description = profile["description"]
-        keywords = profile["keywords"]
-        company_name = profile.get("company_name", "")
+        async with DMSession(user) as session:
+            if session is None:
+                await message.channel.send(
+                    f"{user.mention} You already have a profile conversation open in your DMs. "
+                    "Finish it (or let it time out) first."
+                )
+                return
 
-        await user.send(
-            "Current profile shown below. "
-            "Reply with a new value, or send an empty message to keep the existing value."
-        )
-        await user.send(
-            f"Name/Role: {name_role}\n"
-            f"Description: {description}\n"
-            f"Keywords: {keywords}\n"
-            f"Company: {company_name or 'Not set'}"
-        )
+            await message.channel.send(
+                f"{user.mention} I sent you a DM to update your profile."
+            )
 
-        new_name = await prompt_user(
-            user, "New Name/Role (or leave empty to keep):"
-        )
-        if new_name is None:
-            await user.send("Timed out. Update cancelled.")
-            return
-        if new_name == "":
-            new_name = name_role
+            profile = await db_get_profile(str(user.id))
+            if not profile:
+                await user.send(
+                    "No existing profile found. Use `@MatchBot create-profile` to create one."
+                )
+                return
 
-        new_desc = await prompt_user(
-            user, "New Description (or leave empty to keep):"
-        )
-        if new_desc is None:
-            await user.send("Timed out. Update cancelled.")
-            return
-        if new_desc == "":
-            new_desc = description
+            name_role = profile["name"]
+            description = profile["description"]
+            keywords = profile["keywords"]
+            company_name = profile["company_name"]
 
-        new_keywords = await prompt_user(
-            user,
-            "New Keywords — comma separated (or leave empty to keep):",
-        )
-        if new_keywords is None:
-            await user.send("Timed out. Update cancelled.")
-            return
-        if new_keywords == "":
-            new_keywords_norm = keywords
-        else:
-            new_keywords_norm = ",".join(
-                [k.strip().lower() for k in new_keywords.split(",") if k.strip()]
+            await user.send(
+                "Current profile shown below. "
+                "Reply with a new value, or send an empty message to keep the existing value.\n"
+                f"Name/Role: {name_role}\n"
+                f"Description: {description}\n"
+                f"Keywords: {keywords}\n"
+                f"Company: {company_name or 'Not set'}"
             )
 
-        new_company = await prompt_user(
-            user, "New Company/Organization (or leave empty to keep):"
-        )
-        if new_company is None:
-            await user.send("Timed out. Update cancelled.")
-            return
-        if new_company == "":
-            new_company = company_name
-
-        db.upsert_profile(
-            user_id=str(user.id),
-            name=new_name,
-            role=new_name,
-            description=new_desc,
-            keywords=new_keywords_norm,
-            company_name=new_company,
-        )
-
-        await user.send("✅ Profile updated.")
+            new_name = await session.ask(
+                "New Name/Role (or leave empty to keep):"
+            )
+            if new_name is None:
+                await user.send("Timed out. Update cancelled.")
+                return
+            if new_name == "":
+                new_name = name_role
+
+            new_desc = await session.ask(
+                "New Description (or leave empty to keep):"
+            )
+            if new_desc is None:
+                await user.send("Timed out. Update cancelled.")
+                return
+            if new_desc == "":
+                new_desc = description
+
+            new_keywords = await session.ask(
+                "New Keywords — comma separated (or leave empty to keep):",
+            )
+            if new_keywords is None:
+                await user.send("Timed out. Update cancelled.")
+                return
+            if new_keywords == "":
+                new_keywords_norm = keywords
+            else:
+                new_keywords_norm = normalize_keywords(new_keywords)
+
+            new_company = await session.ask(
+                "New Company/Organization (or leave empty to keep):"
+            )
+            if new_company is None:
+                await user.send("Timed out. Update cancelled.")
+                return
+            if new_company == "":
+                new_company = company_name
+
+            try:
+                await save_profile(dict(
+                    user_id=str(user.id),
+                    name=new_name,
+                    role=new_name,
+                    description=new_desc,
+                    keywords=new_keywords_norm,
+                    company_name=new_company,
+                ))
+            except Exception:
+                await user.send("Could not save your profile. Please try again later.")
+                return
+
+            await user.send("✅ Profile updated.")
 
     # -------------------------------------------------------------------
     # SEARCH PROFILES
@@ -302,7 +450,7 @@ async def on_message(message: discord.Message) -> None:
             return
 
         keyword = " ".join(args).strip().lower()
-        results = db.search(keyword)
+        results = await db_search(keyword)
 
         if not results:
             await message.channel.send(
@@ -340,7 +488,7 @@ async def on_message(message: discord.Message) -> None:
     # LIST PROFILES
     # -------------------------------------------------------------------
     elif cmd == "list-profile":
-        profiles = db.list_all_profiles()
+        profiles = await db_list_profiles()
         
         if not profiles:
             await message.channel.send("No profiles found in the database.")
@@ -1,153 +1,368 @@
+import functools
 import sqlite3
+import threading
 import time
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterable, Iterator
+
+__all__ = ["Database", "normalize_keywords"]
+
+
+def _fts_query(keyword: str) -> str:
+    """Quote user input as a single FTS5 prefix phrase so operators in it are not interpreted."""
+    return '"' + keyword.replace('"', '""') + '"*'
+
+
+def _iter_keyword_tokens(keywords: str) -> Iterator[str]:
+    """
+    Yield the non-empty, whitespace-stripped tokens of a comma separated string.
+
+    Walks the string with find() instead of split() so no intermediate list is
+    built, and only calls strip() on tokens that actually have surrounding
+    whitespace.
+    """
+    pos = 0
+    n = len(keywords)
+    while pos <= n:
+        end = keywords.find(',', pos)
+        if end == -1:
+            end = n
+        token = keywords[pos:end]
+        if token and (token[0].isspace() or token[-1].isspace()):
+            token = token.strip()
+        if token:
+            yield token
+        pos = end + 1
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_keywords(keywords: str) -> str:
+    """
+    Canonical stored form of a comma separated keyword list: stripped,
+    lowercased, de-duplicated and sorted. Cached, so normalizing an already
+    normalized string again on write is a dict lookup.
+    """
+    return ','.join(sorted({k.lower() for k in _iter_keyword_tokens(keywords)}))
+
 
 class Database:
+    # Bump whenever _ensure_table gains a new migration step
+    _SCHEMA_VERSION = 5
+
+    # Current schema; every statement is idempotent so it can be replayed over
+    # an older file once its missing columns have been added
+    _SQL_SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS profiles (
+            user_id TEXT PRIMARY KEY,
+            name TEXT,
+            role TEXT,
+            description TEXT,
+            keywords TEXT,
+            company_name TEXT,
+            linkedin_url TEXT,
+            updated_at INTEGER
+        );
+
+        -- Covering index for the "most recently updated" listings
+        CREATE INDEX IF NOT EXISTS idx_profiles_updated_at ON profiles (updated_at, user_id, name);
+
+        -- Interned keyword vocabulary
+        CREATE TABLE IF NOT EXISTS keywords (
+            id INTEGER PRIMARY KEY,
+            token TEXT UNIQUE COLLATE NOCASE
+        );
+        CREATE TABLE IF NOT EXISTS profile_keywords (
+            user_id TEXT,
+            token_id INTEGER,
+            PRIMARY KEY (user_id, token_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_pk_tok ON profile_keywords (token_id);
+
+        -- Full-text index over the searchable columns, kept in sync by triggers
+        CREATE VIRTUAL TABLE IF NOT EXISTS profiles_fts USING fts5(
+            name, role, description, keywords, company_name, linkedin_url,
+            content='profiles',
+            content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS profiles_ai AFTER INSERT ON profiles BEGIN
+            INSERT INTO profiles_fts(rowid, name, role, description, keywords, company_name, linkedin_url)
+            VALUES (new.rowid, new.name, new.role, new.description, new.keywords, new.company_name, new.linkedin_url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS profiles_ad AFTER DELETE ON profiles BEGIN
+            INSERT INTO profiles_fts(profiles_fts, rowid, name, role, description, keywords, company_name, linkedin_url)
+            VALUES ('delete', old.rowid, old.name, old.role, old.description, old.keywords, old.company_name, old.linkedin_url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS profiles_au AFTER UPDATE ON profiles BEGIN
+            INSERT INTO profiles_fts(profiles_fts, rowid, name, role, description, keywords, company_name, linkedin_url)
+            VALUES ('delete', old.rowid, old.name, old.role, old.description, old.keywords, old.company_name, old.linkedin_url);
+            INSERT INTO profiles_fts(rowid, name, role, description, keywords, company_name, linkedin_url)
+            VALUES (new.rowid, new.name, new.role, new.description, new.keywords, new.company_name, new.linkedin_url);
+        END;
+    '''
+
+    # SQL text is kept constant so sqlite3's statement cache can reuse the prepared statements
+    _SQL_UPSERT = '''
+        INSERT INTO profiles (user_id, name, role, description, keywords, company_name, linkedin_url, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+          name=excluded.name,
+          role=excluded.role,
+          description=excluded.description,
+          keywords=excluded.keywords,
+          company_name=excluded.company_name,
+          linkedin_url=excluded.linkedin_url,
+          updated_at=excluded.updated_at
+    '''
+    _SQL_GET = '''
+        SELECT user_id, name, role, description, keywords, company_name, linkedin_url, updated_at
+        FROM profiles
+        WHERE user_id = ?
+    '''
+    # "Why did this match" summary for each row of a search page: matching
+    # keyword tokens, then "name" / "company", else "profile match"
+    _SQL_MATCHED_KEYWORDS = '''
+          coalesce((SELECT group_concat(m, ', ') FROM (
+              SELECT 0 AS grp, k.token AS m
+              FROM profile_keywords pk
+              JOIN keywords k ON k.id = pk.token_id
+              WHERE pk.user_id = page.user_id AND k.token LIKE :like
+              UNION ALL
+              SELECT 1, 'name' WHERE page.name LIKE :like
+              UNION ALL
+              SELECT 2, 'company' WHERE page.company_name LIKE :like
+              ORDER BY grp, m
+          )), 'profile match') AS matched_keywords
+    '''
+    # Full-text hits first, then profiles whose keyword tokens contain the
+    # query mid-word (e.g. "security" in "cybersecurity"), which FTS prefix
+    # matching cannot see
+    _SQL_SEARCH = '''
+        WITH hits AS (
+            SELECT profiles_fts.rowid AS rid, bm25(profiles_fts) AS score
+            FROM profiles_fts
+            WHERE profiles_fts MATCH :match
+            UNION ALL
+            SELECT p.rowid, 0.0
+            FROM profiles p
+            WHERE p.user_id IN (
+                SELECT pk.user_id
+                FROM profile_keywords pk
+                WHERE pk.token_id IN (SELECT id FROM keywords WHERE token LIKE :like)
+            )
+            AND p.rowid NOT IN (SELECT rowid FROM profiles_fts WHERE profiles_fts MATCH :match)
+        ),
+        page AS (
+            SELECT p.user_id, p.name, p.role, p.description, p.keywords, p.company_name, p.linkedin_url,
+              p.updated_at, h.score
+            FROM hits h
+            JOIN profiles p ON p.rowid = h.rid
+            ORDER BY h.score, p.updated_at DESC
+            LIMIT :limit
+        )
+        SELECT page.*,''' + _SQL_MATCHED_KEYWORDS + '''
+        FROM page
+        ORDER BY page.score, page.updated_at DESC
+    '''
+    # Plain substring scan; cheaper than the FTS query while the table is small.
+    # The per-column score doubles as the filter, so each LIKE runs once per
+    # row instead of once in WHERE and again in the score. LIMIT -1 keeps
+    # SQLite from flattening the subquery and re-running the score in the
+    # outer WHERE; only the page's rows are joined back for their columns.
+    # Scores are negated so both queries sort ascending.
+    _SQL_SEARCH_SMALL = '''
+        WITH hits AS (
+            SELECT rid, score, updated_at
+            FROM (
+                SELECT rowid AS rid, updated_at,
+                  -((CASE WHEN name LIKE :like THEN 1 ELSE 0 END)
+                    + (CASE WHEN role LIKE :like THEN 1 ELSE 0 END)
+                    + (CASE WHEN description LIKE :like THEN 1 ELSE 0 END)
+                    + (CASE WHEN keywords LIKE :like THEN 1 ELSE 0 END)
+                    + (CASE WHEN company_name LIKE :like THEN 1 ELSE 0 END)
+                    + (CASE WHEN linkedin_url LIKE :like THEN 1 ELSE 0 END)) AS score
+                FROM profiles
+                LIMIT -1
+            )
+            WHERE score < 0
+            ORDER BY score, updated_at DESC
+            LIMIT :limit
+        ),
+        page AS (
+            SELECT p.user_id, p.name, p.role, p.description, p.keywords, p.company_name, p.linkedin_url,
+              p.updated_at, h.score
+            FROM hits h
+            JOIN profiles p ON p.rowid = h.rid
+        )
+        SELECT page.*,''' + _SQL_MATCHED_KEYWORDS + '''
+        FROM page
+        ORDER BY page.score, page.updated_at DESC
+    '''
+    # Row count below which search() uses _SQL_SEARCH_SMALL.
+    #
+    # The two queries do NOT match the same way, so results change when the
+    # table crosses this size:
+    #   - below it, the keyword matches as a substring anywhere in name, role,
+    #     description, keywords, company or LinkedIn URL ("vest" finds
+    #     "investing" in a description);
+    #   - at or above it, free-text columns only match on word prefixes via FTS
+    #     ("vest" does not find "investing"); substring matching is kept only
+    #     for keyword tags, through the interned keyword tables.
+    # profiles_fts and its triggers are maintained on every write even while
+    # the small-table query is in use, so switching over needs no rebuild.
+    _SMALL_TABLE_ROWS = 5000
+    _SQL_SEARCH_ROLES = '''
+        SELECT user_id, name, role, description, keywords, company_name, linkedin_url
+        FROM profiles
+        WHERE role LIKE ?
+        ORDER BY updated_at DESC
+        LIMIT ?
+    '''
+    _SQL_LIST = 'SELECT user_id, name FROM profiles ORDER BY updated_at DESC'
+
     def __init__(self, path: str = 'profiles.db'):
         self._path = path
-        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn = sqlite3.connect(self._path, check_same_thread=False, cached_statements=256)
         self._conn.row_factory = sqlite3.Row
+        # The connection is shared with worker threads; serialize the writers
+        self._write_lock = threading.Lock()
+        # Read caches are keyed by a write generation so a result computed
+        # concurrently with a write is never served after it
+        self._generation = 0
+        self._profile_cache = functools.lru_cache(maxsize=1024)(self._load_profile)
+        self._search_cache = functools.lru_cache(maxsize=1024)(self._run_search)
+        self._configure_connection()
         self._ensure_table()
+        self._choose_search_sql()
+
+    def _choose_search_sql(self):
+        """Pick the search query for the current table size."""
+        n_profiles = self._conn.execute('SELECT count(*) FROM profiles').fetchone()[0]
+        self._search_sql = self._SQL_SEARCH_SMALL if n_profiles < self._SMALL_TABLE_ROWS else self._SQL_SEARCH
+
+    def _configure_connection(self):
+        """Per-connection tuning: WAL journal, relaxed fsync, memory-mapped reads."""
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA mmap_size=268435456')
+        self._conn.execute('PRAGMA cache_size=-65536')
+        self._conn.execute('PRAGMA temp_store=MEMORY')
+        # Wait instead of failing with "database is locked" on concurrent writes
+        self._conn.execute('PRAGMA busy_timeout=5000')
 
     def _ensure_table(self):
-        with self._conn:
-            self._conn.execute('''
-            CREATE TABLE IF NOT EXISTS profiles (
-                user_id TEXT PRIMARY KEY,
-                name TEXT,
-                role TEXT,
-                description TEXT,
-                keywords TEXT,
-                company_name TEXT,
-                linkedin_url TEXT,
-                updated_at INTEGER
-            )
-            ''')
-            # Migration: Add company_name column if it doesn't exist
-            self._migrate_add_company_name()
-            # Migration: Add linkedin_url column if it doesn't exist
-            self._migrate_add_linkedin_url()
-
-    def _migrate_add_company_name(self):
-        """Migration method to add company_name column to existing tables."""
-        try:
-            # Check if company_name column already exists
-            cursor = self._conn.execute("PRAGMA table_info(profiles)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'company_name' not in columns:
-                print("Migrating database: Adding company_name column...")
-                self._conn.execute('ALTER TABLE profiles ADD COLUMN company_name TEXT')
-                print("Migration completed successfully!")
-            else:
-                print("Database already up to date - company_name column exists.")
-        except Exception as e:
-            print(f"Migration error: {e}")
-
-    def _migrate_add_linkedin_url(self):
-        """Migration method to add linkedin_url column to existing tables."""
+        # Skip the migrations entirely once the file is on the current schema
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] >= self._SCHEMA_VERSION:
+            return
+        print(f"Migrating database to schema version {self._SCHEMA_VERSION}...")
+
+        # Columns added after the first release; empty when the table is new
+        existing = {r['name'] for r in self._conn.execute('PRAGMA table_info(profiles)')}
+        alters = ''.join(
+            f'ALTER TABLE profiles ADD COLUMN {column} TEXT;\n'
+            for column in ('company_name', 'linkedin_url')
+            if existing and column not in existing
+        )
+
+        # All DDL goes through one script, which opens the transaction that the
+        # backfills and the version stamp below commit in
         try:
-            # Check if linkedin_url column already exists
-            cursor = self._conn.execute("PRAGMA table_info(profiles)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'linkedin_url' not in columns:
-                print("Migrating database: Adding linkedin_url column...")
-                self._conn.execute('ALTER TABLE profiles ADD COLUMN linkedin_url TEXT')
-                print("Migration completed successfully!")
-            else:
-                print("Database already up to date - linkedin_url column exists.")
-        except Exception as e:
-            print(f"Migration error: {e}")
+            self._conn.executescript('BEGIN;\n' + alters + self._SQL_SCHEMA)
+            # Index existing rows before the backfills fire the sync triggers
+            self._conn.execute("INSERT INTO profiles_fts(profiles_fts) VALUES('rebuild')")
+            self._backfill_keyword_tokens()
+            self._conn.execute(f'PRAGMA user_version = {self._SCHEMA_VERSION}')
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        print("Migration completed successfully!")
+
+    def _backfill_keyword_tokens(self):
+        """Migration method to intern existing keywords into keywords/profile_keywords."""
+        rows = self._conn.execute('SELECT user_id, keywords FROM profiles').fetchall()
+        if rows:
+            print(f"Migrating database: Interning keywords for {len(rows)} profile(s)...")
+            self._store_keyword_tokens((r['user_id'], r['keywords']) for r in rows)
+
+    def _store_keyword_tokens(self, rows: Iterable[tuple]):
+        """Rewrite the profile_keywords rows for each (user_id, keywords) pair."""
+        for user_id, keywords in rows:
+            tokens = [(t,) for t in normalize_keywords(keywords or '').split(',') if t]
+            self._conn.execute('DELETE FROM profile_keywords WHERE user_id = ?', (user_id,))
+            self._conn.executemany('INSERT OR IGNORE INTO keywords (token) VALUES (?)', tokens)
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO profile_keywords (user_id, token_id) SELECT ?, id FROM keywords WHERE token = ?',
+                [(user_id, t) for (t,) in tokens],
+            )
 
     def upsert_profile(self, user_id: str, name: str, role: str, description: str, keywords: str, company_name: str = None, linkedin_url: str = None):
         now = int(time.time())
-        with self._conn:
-            self._conn.execute('''
-                INSERT INTO profiles (user_id, name, role, description, keywords, company_name, linkedin_url, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET
-                  name=excluded.name,
-                  role=excluded.role,
-                  description=excluded.description,
-                  keywords=excluded.keywords,
-                  company_name=excluded.company_name,
-                  linkedin_url=excluded.linkedin_url,
-                  updated_at=excluded.updated_at
-            ''', (user_id, name, role, description, keywords, company_name, linkedin_url, now))
-
-    def get_profile(self, user_id: str) -> Optional[Dict]:
-        cur = self._conn.execute('SELECT user_id, name, role, description, keywords, company_name, linkedin_url, updated_at FROM profiles WHERE user_id = ?', (user_id,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {k: row[k] for k in row.keys()}
-
-    def search(self, keyword: str, limit: int = 20) -> List[Dict]:
-        kw = f'%{keyword}%'
-        sql = '''
-        SELECT user_id, name, role, description, keywords, company_name, linkedin_url,
-          (CASE WHEN lower(name) LIKE ? THEN 1 ELSE 0 END)
-          + (CASE WHEN lower(role) LIKE ? THEN 1 ELSE 0 END)
-          + (CASE WHEN lower(description) LIKE ? THEN 1 ELSE 0 END)
-          + (CASE WHEN lower(keywords) LIKE ? THEN 1 ELSE 0 END)
-          + (CASE WHEN lower(company_name) LIKE ? THEN 1 ELSE 0 END)
-          + (CASE WHEN lower(linkedin_url) LIKE ? THEN 1 ELSE 0 END) AS score
-        FROM profiles
-        WHERE lower(name) LIKE ? OR lower(role) LIKE ? OR lower(description) LIKE ? 
-        OR lower(keywords) LIKE ? OR lower(company_name) LIKE ? OR lower(linkedin_url) LIKE ?
-        ORDER BY score DESC, updated_at DESC
-        LIMIT ?
-        '''
-        cur = self._conn.execute(sql, (kw, kw, kw, kw, kw, kw, kw, kw, kw, kw, kw, kw, limit))
-        rows = cur.fetchall()
-        results = []
-        for r in rows:
-            # compute which keywords matched (simple intersection)
-            matched = []
-            klist = [k.strip() for k in (r['keywords'] or '').split(',') if k.strip()]
-            search_fields = [
-                (r['name'] or '').lower(),
-                (r['role'] or '').lower(),
-                (r['description'] or '').lower(),
-                (r['company_name'] or '').lower(),
-                (r['linkedin_url'] or '').lower()
-            ]
-            
-            # Check which keywords and fields matched
-            for k in klist:
-                if keyword in k.lower():
-                    matched.append(k)
-            
-            # Add field names that matched
-            if keyword in (r['name'] or '').lower():
-                matched.append('name')
-            if keyword in (r['company_name'] or '').lower():
-                matched.append('company')
-            
-            results.append({
-                'user_id': r['user_id'],
-                'name': r['name'],
-                'role': r['role'],
-                'description': r['description'],
-                'keywords': r['keywords'],
-                'company_name': r['company_name'],
-                'linkedin_url': r['linkedin_url'],
-                'matched_keywords': ', '.join(matched) if matched else 'profile match'
-            })
-        return results
+        with self._write_lock:
+            try:
+                with self._conn:
+                    self._conn.execute(self._SQL_UPSERT, (
+                        user_id, name, role, description, keywords,
+                        company_name, linkedin_url, now,
+                    ))
+                    self._store_keyword_tokens([(user_id, keywords)])
+            finally:
+                self._invalidate_caches()
+
+    def upsert_many(self, profiles: Iterable[Dict]):
+        """Write a batch of profiles (dicts of upsert_profile arguments) in a single transaction."""
+        now = int(time.time())
+        rows = [
+            (p['user_id'], p['name'], p['role'], p['description'], p['keywords'],
+             p.get('company_name'), p.get('linkedin_url'), now)
+            for p in profiles
+        ]
+        with self._write_lock:
+            try:
+                with self._conn:
+                    self._conn.executemany(self._SQL_UPSERT, rows)
+                    self._store_keyword_tokens((r[0], r[4]) for r in rows)
+            finally:
+                self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        """
+        Drop cached reads after a write, whether it committed or rolled back:
+        readers share this connection, so they may have cached rows from the
+        open transaction. Called with the write lock held.
+        """
+        self._choose_search_sql()
+        self._generation += 1
+        self._profile_cache.cache_clear()
+        self._search_cache.cache_clear()
+
+    def get_profile(self, user_id: str) -> Optional[sqlite3.Row]:
+        """Cached; sqlite3.Row supports profile["name"] style access."""
+        return self._profile_cache(self._generation, user_id)
+
+    def _load_profile(self, generation: int, user_id: str) -> Optional[sqlite3.Row]:
+        return self._conn.execute(self._SQL_GET, (user_id,)).fetchone()
+
+    def search(self, keyword: str, limit: int = 20) -> List[sqlite3.Row]:
+        """
+        Cached; the returned list is shared and must not be mutated.
+
+        Matching depends on table size, see _SMALL_TABLE_ROWS.
+        """
+        return self._search_cache(self._generation, keyword, limit)
+
+    def _run_search(self, generation: int, keyword: str, limit: int) -> List[sqlite3.Row]:
+        # The small-table query ignores :match
+        cur = self._conn.execute(self._search_sql, {
+            'match': _fts_query(keyword),
+            'like': f'%{keyword}%',
+            'limit': limit,
+        })
+        return cur.fetchall()
 
     def search_roles(self, keyword: str, limit: int = 20) -> List[Dict]:
-        """Search for profiles by role only."""
+        """Search for profiles by role only (LIKE is already case-insensitive for ASCII)."""
         kw = f'%{keyword}%'
-        sql = '''
-        SELECT user_id, name, role, description, keywords, company_name, linkedin_url
-        FROM profiles
-        WHERE lower(role) LIKE ?
-        ORDER BY updated_at DESC
-        LIMIT ?
-        '''
-        cur = self._conn.execute(sql, (kw, limit))
+        cur = self._conn.execute(self._SQL_SEARCH_ROLES, (kw, limit))
         rows = cur.fetchall()
         return [{
             'user_id': r['user_id'],
@@ -161,6 +376,6 @@ class Database:
 
     def list_all_profiles(self) -> List[Dict]:
         """Get all profile names ordered by most recently updated."""
-        cur = self._conn.execute('SELECT user_id, name FROM profiles ORDER BY updated_at DESC')
+        cur = self._conn.execute(self._SQL_LIST)
         rows = cur.fetchall()
         return [{'user_id': r['user_id'], 'name': r['name']} for r in rows]